@@ -2,12 +2,15 @@
 
 import logging
 
-from re import subn
+from re import compile as re_compile
 
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, Optional
+from functools import lru_cache
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, DefaultDict, Dict, Optional, Union
 
-from ipaddress import ip_interface, ip_network
+from ipaddress import IPv4Address, IPv6Address, ip_interface, ip_network
 
 from homer.netbox import BaseNetboxDeviceData
 
@@ -42,6 +45,51 @@ SWITCHES_ROLES = ('asw', 'cloudsw')
 L3_SWITCHES_MODELS = ('qfx5120-48y-afi', 'qfx5120-48y-afi2')
 JUNIPER_LEGACY_SW = ('qfx5100-48s-6q', 'ex4600-40f', 'ex4300-48t')
 NO_QOS_INTS = ('irb', 'lo', 'fxp', 'em', 'vme')
+CORE_LINK_Z_DEV_ROLES = ('cr', 'asw', 'mr', 'msw', 'pfw', 'cloudsw')  # Links to those devices are 'Core' links
+IGNORED_INTERFACES = ('fxp0-re0', 'fxp0-re1')  # Those are managed in `set groups`
+TUNNEL_INTS = ('gr-', 'st')
+# Default link data of an interface, see NetboxDeviceDataPlugin._get_link_data()
+LINK_DATA_DEFAULTS = {
+    "enabled": True,
+    "nb_int_desc": None,
+    "circuit_id": None,
+    "circuit_desc": '',
+    "link_type": '',
+    "z_dev": '',
+    "z_int": '',
+    "wmf_z_end": True,
+    "upstream_speed": None
+}
+SPEED_REGEX = re_compile(r'^(\d+)gbase')
+SERVER_NUMBER_REGEX = re_compile(r'\d{4}')
+
+
+@lru_cache(maxsize=None)
+def interface_speed(interface_type: str) -> int:
+    """Returns the port speed in Gbps of a Netbox interface type, 1 for the 1000base ones, cached as types repeat."""
+    if interface_type.startswith('1000base'):
+        return 1
+    match = SPEED_REGEX.match(interface_type)
+    if not match:
+        raise ValueError(f'Unable to get the port speed of interface type {interface_type}')
+    return int(match.group(1))
+
+
+# The same Netbox addresses get parsed multiple times, also across devices (e.g. anycast gateways, VRRP VIPs)
+cached_ip_interface = lru_cache(maxsize=None)(ip_interface)
+
+
+def address_ip(address: str) -> Union[IPv4Address, IPv6Address]:
+    """Returns the IP of a Netbox address with prefix length (e.g. 10.0.0.1/24)."""
+    return cached_ip_interface(address).ip
+
+
+@lru_cache(maxsize=None)
+def is_legacy_vlan_name(vlan_name: str) -> bool:
+    """Returns true if vlan name convention is legacy row-wide, cached as the same few vlans are checked over."""
+    split_name = vlan_name.split('-', 2)
+    # If no rack location in vlan name or rack location is only 1 char (i.e. row-wide)
+    return len(split_name) < 3 or len(split_name[1]) == 1
 
 
 class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
@@ -51,41 +99,184 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
         """Initialize the instance."""
         super().__init__(netbox_api, device)
         self._device_interfaces = None
+        self._interfaces_by_name = {}
         self._device_ip_addresses = None
-        self._interface_ip_addresses = None
-        self._bgp_servers = []
-        self._junos_interfaces = {}
-        self._qos_interfaces = {}
+        self._interface_ip_addresses = {}
+        self._tunnels = None
+        self._vpn_objects = {}
+        self._fhrp_assignments = None
+        self._fhrp_groups = None
+        self._interfaces_scan = None
+        self._bgp_servers = None
+        self._junos_interfaces = None
+        self._qos_interfaces = None
         self.device_id = self._device.metadata['netbox_object'].id
         self.role = self._device.metadata['netbox_object'].role
         self.device_type = self._device.metadata['netbox_object'].device_type
         self.device_rack = self._device.metadata['netbox_object'].rack
         self.device_site = self._device.metadata['netbox_object'].site
         self.virtual_chassis = self._device.metadata['netbox_object'].virtual_chassis
+        # Device kinds checked many times, only once here
+        self.is_switch = self.role.slug in SWITCHES_ROLES
+        self.is_l3_switch = self.is_switch and self.device_type.slug in L3_SWITCHES_MODELS
+        self.is_legacy_switch = self.device_type.slug in JUNIPER_LEGACY_SW
+        self.is_cr = self.role.slug == 'cr'
 
     def fetch_device_interfaces(self):
         """Fetch interfaces from Netbox."""
-        if not self._device_interfaces:
-            if self.virtual_chassis:
-                interfaces_filter = {'virtual_chassis_id': self.virtual_chassis.id}
-            else:
-                interfaces_filter = {'device_id': self.device_id}
-            # Consume the generator or it will be empty if looped more than once.
-            self._device_interfaces = list(self._api.dcim.interfaces.filter(**interfaces_filter))
+        if self._device_interfaces is None:
+            self._prefetch('interfaces').result()
         return self._device_interfaces
 
+    def _load_device_interfaces(self):
+        """Load the device interfaces from Netbox and index them by name."""
+        if self.virtual_chassis:
+            interfaces_filter = {'virtual_chassis_id': self.virtual_chassis.id}
+        else:
+            interfaces_filter = {'device_id': self.device_id}
+        # Consume the generator or it will be empty if looped more than once.
+        # limit=0 makes Netbox return up to its maximum page size in the first response. Without it pynetbox gets a
+        # first page of the default size and only then asks for the rest, so this saves at most one call.
+        device_interfaces = list(self._api.dcim.interfaces.filter(**interfaces_filter, limit=0))
+        self._interfaces_by_name = {nb_int.name: nb_int for nb_int in device_interfaces}
+        self._device_interfaces = device_interfaces
+
+    def get_device_interface(self, interface_name: str):
+        """Return the device interface with the given name, None if there is none."""
+        self.fetch_device_interfaces()
+        return self._interfaces_by_name.get(interface_name)
+
     def fetch_device_ip_addresses(self):
         """Fetch IPs from Netbox."""
-        if not self._device_ip_addresses:
-            # Consume the generator or it will be empty if looped more than once.
-            self._device_ip_addresses = list(self._api.ipam.ip_addresses.filter(device_id=self.device_id))
+        if self._device_ip_addresses is None:
+            self._prefetch('ip_addresses').result()
         return self._device_ip_addresses
 
+    def _load_device_ip_addresses(self):
+        """Load the device IPs from Netbox and group them by interface ID and family."""
+        # Consume the generator or it will be empty if looped more than once.
+        device_ip_addresses = list(self._api.ipam.ip_addresses.filter(device_id=self.device_id, limit=0))
+        # Group them by interface ID and family at once, as they are consumed per interface
+        self._interface_ip_addresses = {}
+        for ip_address in device_ip_addresses:
+            interface_ips = self._interface_ip_addresses.setdefault(ip_address.assigned_object_id, {4: [], 6: []})
+            interface_ips[ip_address.family.value].append(ip_address)
+        self._device_ip_addresses = device_ip_addresses
+
+    def _prefetch(self, needed: str) -> Future:
+        """Fetch in parallel the device interfaces and IPs not fetched yet, as most keys need both.
+
+        Arguments:
+            needed (str): the fetch the caller needs, either 'interfaces' or 'ip_addresses'.
+
+        Returns:
+            concurrent.futures.Future: the future of the needed fetch, the caller re-raises its error if any. The
+            error of the other fetch is only logged, it is attempted again by the next call needing it.
+
+        """
+        futures = {}
+        # Those are I/O bound HTTP calls, pynetbox shares the same session across threads in its own threading mode
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if self._device_interfaces is None:
+                futures['interfaces'] = executor.submit(self._load_device_interfaces)
+            if self._device_ip_addresses is None:
+                futures['ip_addresses'] = executor.submit(self._load_device_ip_addresses)
+
+        for name, future in futures.items():
+            error = future.exception()
+            if name != needed and error is not None:
+                logger.error(f"Failed to prefetch the device {name}, will retry when needed: {error}")
+        return futures[needed]
+
+    def fetch_tunnels(self):
+        """Fetch at once the tunnels of the enabled tunnel interfaces, keyed by interface ID.
+
+        Each value is a tuple with the interface tunnel termination, its tunnel and the termination at the other end
+        of the tunnel (None for spoke tunnels or if missing).
+        """
+        if self._tunnels is not None:
+            return self._tunnels
+
+        self._tunnels = {}
+        tunnel_interface_ids = [nb_int.id for nb_int in self.fetch_device_interfaces()
+                                if nb_int.enabled and nb_int.name.startswith(TUNNEL_INTS)]
+        if not tunnel_interface_ids:
+            return self._tunnels
+
+        tunnel_terminations = list(self._api.vpn.tunnel_terminations.filter(
+            termination_type='dcim.interface', termination_id=tunnel_interface_ids, limit=0))
+        if not tunnel_terminations:
+            return self._tunnels
+
+        tunnel_ids = list({tunnel_termination.tunnel.id for tunnel_termination in tunnel_terminations})
+        tunnels = {tunnel.id: tunnel for tunnel in self._api.vpn.tunnels.filter(id=tunnel_ids, limit=0)}
+        # Only the non-spoke tunnels need their other end
+        peer_tunnel_ids = list({tunnel_termination.tunnel.id for tunnel_termination in tunnel_terminations
+                                if tunnel_termination.role.value != 'spoke'})
+        peer_terminations: Dict[int, list] = {}
+        if peer_tunnel_ids:
+            for peer_termination in self._api.vpn.tunnel_terminations.filter(tunnel_id=peer_tunnel_ids, limit=0):
+                peer_terminations.setdefault(peer_termination.tunnel.id, []).append(peer_termination)
+
+        for tunnel_termination in tunnel_terminations:
+            z_end_terminations = [peer_termination for peer_termination
+                                  in peer_terminations.get(tunnel_termination.tunnel.id, [])
+                                  if peer_termination.id != tunnel_termination.id]
+            if len(z_end_terminations) > 1:
+                raise ValueError(f'Tunnel {tunnel_termination.tunnel} has more than one termination other than the '
+                                 f'one with ID {tunnel_termination.id}, unable to get its other end')
+            z_end_termination = z_end_terminations[0] if z_end_terminations else None
+            self._tunnels[tunnel_termination.termination_id] = (
+                tunnel_termination, tunnels[tunnel_termination.tunnel.id], z_end_termination)
+        return self._tunnels
+
+    def get_vpn_object(self, endpoint: str, object_id: int):
+        """Get a VPN object by ID from the given endpoint, cached as tunnels share their IPsec profiles and policies."""
+        key = (endpoint, object_id)
+        if key not in self._vpn_objects:
+            self._vpn_objects[key] = getattr(self._api.vpn, endpoint).get(object_id)
+        return self._vpn_objects[key]
+
+    def fetch_fhrp_assignments(self):
+        """Fetch at once the FHRP group assignments of all the device interfaces, keyed by interface ID."""
+        if self._fhrp_assignments is None:
+            self._fhrp_assignments = {}
+            fhrp_interface_ids = [nb_int.id for nb_int in self.fetch_device_interfaces() if nb_int.count_fhrp_groups]
+            if fhrp_interface_ids:
+                for fhrp_assignment in self._api.ipam.fhrp_group_assignments.filter(
+                        interface_type='dcim.interface', interface_id=fhrp_interface_ids, limit=0):
+                    self._fhrp_assignments.setdefault(fhrp_assignment.interface_id, []).append(fhrp_assignment)
+        return self._fhrp_assignments
+
+    def fetch_fhrp_groups(self):
+        """Fetch at once the FHRP groups assigned to the device interfaces, keyed by group ID.
+
+        The assignments only have nested groups without their IPs, that pynetbox would otherwise fetch one by one.
+        """
+        if self._fhrp_groups is None:
+            self._fhrp_groups = {}
+            fhrp_group_ids = list({fhrp_assignment.group.id
+                                   for fhrp_assignments in self.fetch_fhrp_assignments().values()
+                                   for fhrp_assignment in fhrp_assignments})
+            if fhrp_group_ids:
+                self._fhrp_groups = {fhrp_group.id: fhrp_group
+                                     for fhrp_group in self._api.ipam.fhrp_groups.filter(id=fhrp_group_ids, limit=0)}
+        return self._fhrp_groups
+
+    def get_fhrp_group(self, group_id: int):
+        """Return the FHRP group with the given ID, assigned to one of the device interfaces."""
+        fhrp_group = self.fetch_fhrp_groups().get(group_id)
+        if fhrp_group is None:
+            raise ValueError(f'Unable to get the FHRP group with ID {group_id} from Netbox')
+        return fhrp_group
+
     def fetch_bgp_servers_l2(self, site: str = '') -> list:
         """Fetch VMs or servers on legacy vlans with BGP custom field set that should peer with CRs."""
-        if self._bgp_servers:
+        if self._bgp_servers is not None:
             return self._bgp_servers
 
+        self._bgp_servers = []
+
         # We decide if devices should peer with CR based on Vlan membership, we compile
         # in advance the legacy vlans at the site and a list of associated prefixes
         site_vlans = self._api.ipam.vlans.filter(site=site, name__isw=('private1', 'public1'))
@@ -94,132 +285,189 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
             # Sites with only L3 switches and per-rack vlans
             return self._bgp_servers
         legacy_prefixes_nb = self._api.ipam.prefixes.filter(vlan_id=legacy_vlan_ids)
-        legacy_prefixes = [ip_network(legacy_prefix) for legacy_prefix in legacy_prefixes_nb]
+        # Split by IP version, devices are only checked against the prefixes of their own primary IP version
+        legacy_prefixes: Dict[int, list] = {4: [], 6: []}
+        for legacy_prefix in legacy_prefixes_nb:
+            prefix = ip_network(legacy_prefix)
+            legacy_prefixes[prefix.version].append(prefix)
 
         # Build list of active VMs and Hosts at this site with bgp flag enabled
-        filters = {'site': site, 'status': 'active', 'role': 'server', 'cf_bgp': True}
-        bgp_devices = (list(self._api.dcim.devices.filter(**filters))
-                       + list(self._api.virtualization.virtual_machines.filter(**filters)))
+        # The rendered config context is not needed and is expensive for Netbox to compute and send
+        filters = {'site': site, 'status': 'active', 'role': 'server', 'cf_bgp': True, 'exclude': 'config_context'}
+        # Iterated only once, no need to materialize them in lists
+        bgp_devices = chain(self._api.dcim.devices.filter(**filters),
+                            self._api.virtualization.virtual_machines.filter(**filters))
 
         # If they are in a legacy vlan add to the list
         for bgp_device in bgp_devices:
             device_ip = ip_interface(bgp_device.primary_ip)
-            for prefix in legacy_prefixes:
-                if prefix.version == device_ip.version and prefix.supernet_of(device_ip.network):  # type: ignore
-                    self._bgp_servers.append(bgp_device)
-                    break
+            if any(prefix.supernet_of(device_ip.network) for prefix in legacy_prefixes[device_ip.version]):
+                self._bgp_servers.append(bgp_device)
 
         return self._bgp_servers
 
-    def normalize_bgp_neighbor(self, server) -> dict:
-        """Abstraction function to normalize the output of VM and physical servers."""
+    def normalize_bgp_neighbor(self, server, check_status: bool = True) -> dict:
+        """Abstraction function to normalize the output of VM and physical servers.
+
+        The server status and BGP flag checks can be skipped with check_status=False if Netbox already filtered on them.
+        """
         bgp_neighbor = {}
-        if server.status.value != 'active':
+        if check_status and (server.status.value != 'active' or not server.custom_fields["bgp"]):
             return {}
-        if not server.custom_fields["bgp"]:
-            return {}
-        server_prefix, sub_count = subn(r'\d{4}', '', server.name)
+        server_prefix, sub_count = SERVER_NUMBER_REGEX.subn('', server.name)
         if not sub_count:
             logger.error(f"Can't extract the server prefix from {server.name}.")
             return {}
-        try:
-            bgp_group = HOSTNAMES_TO_GROUPS[server_prefix]['group']
-        except KeyError:
+        group = HOSTNAMES_TO_GROUPS.get(server_prefix)
+        if group is None:
             logger.error(f"No BGP group found for {server.name}.")
             return {}
-        if 'ipv4_only' in HOSTNAMES_TO_GROUPS[server_prefix]:
-            ipv4_only = HOSTNAMES_TO_GROUPS[server_prefix]['ipv4_only']
-        else:
-            ipv4_only = False
+        bgp_group = group['group']
+        ipv4_only = group.get('ipv4_only', False)
         if server.primary_ip4:
-            bgp_neighbor[4] = ip_interface(server.primary_ip4).ip
+            bgp_neighbor[4] = address_ip(str(server.primary_ip4))
         if server.primary_ip6 and not ipv4_only:
-            bgp_neighbor[6] = ip_interface(server.primary_ip6).ip
+            bgp_neighbor[6] = address_ip(str(server.primary_ip6))
         return {'group': bgp_group, 'name': server.name, 'ip_addresses': bgp_neighbor}
 
     def legacy_vlan_name(self, vlan_name) -> bool:
         """Returns true if vlan name convention is legacy row-wide."""
-        split_name = vlan_name.split('-')
-        # If no rack location in vlan name or rack location is only 1 char (i.e. row-wide)
-        if len(split_name) < 3 or len(split_name[1]) == 1:
-            return True
-        return False
+        return is_legacy_vlan_name(vlan_name)
 
     def _get_bgp_servers(self) -> dict:
         """Servers that need BGP configured on that router."""
         bgp_neighbors: DefaultDict = defaultdict(dict)
         # For L3 switches iterate over the direcly connected servers
-        if self.role.slug in SWITCHES_ROLES and self.device_type.slug in L3_SWITCHES_MODELS:
-            ganeti_clusters = set()
+        if self.is_l3_switch:
+            connected_devices = []
             for interface in self.fetch_device_interfaces():
                 if interface.connected_endpoints_type != 'dcim.interface':
                     continue
                 if not interface.untagged_vlan or self.legacy_vlan_name(interface.untagged_vlan.name):
                     continue
                 try:
-                    z_device = interface.connected_endpoints[0].device
+                    connected_devices.append(interface.connected_endpoints[0].device)
+                except AttributeError:
+                    continue
+
+            # The connected devices are nested brief objects, reading their rack or cluster would make pynetbox
+            # fetch each of them in turn, get all of them at once instead.
+            devices = {}
+            if connected_devices:
+                devices = {device.id: device for device in self._api.dcim.devices.filter(
+                    id=list({device.id for device in connected_devices}), exclude='config_context', limit=0)}
+
+            z_devices = []
+            for connected_device in connected_devices:
+                z_device = devices.get(connected_device.id)
+                if z_device is None:
+                    continue
+                try:
                     if z_device.rack != self.device_rack:  # Skip links to devices in other racks (i.e. lvs)
                         continue
+                    z_devices.append((z_device, z_device.cluster))
+                except AttributeError:
+                    continue
 
-                    # For Ganeti hosts we need to work out if VMs peer with the switch
-                    if z_device.cluster and z_device.cluster not in ganeti_clusters:
-                        ganeti_clusters.add(z_device.cluster)
-                        hypervisors = self._api.dcim.devices.filter(cluster_id=z_device.cluster.id)
-                        hypervisor_racks = set([hypervisor.rack for hypervisor in hypervisors])
-                        if len(hypervisor_racks) == 1:
-                            # Cluster is only in this rack, VMs should peer with SW not CR
-                            bgp_vms = self._api.virtualization.virtual_machines.filter(
-                                cluster_id=z_device.cluster.id, cf_bgp=True)
-                            for bgp_vm in bgp_vms:
-                                neighbor = self.normalize_bgp_neighbor(bgp_vm)
-                                if neighbor:
-                                    bgp_neighbors[neighbor['group']][neighbor['name']] = neighbor['ip_addresses']
-
-                    neighbor = self.normalize_bgp_neighbor(z_device)
-                    if neighbor:
-                        bgp_neighbors[neighbor['group']][neighbor['name']] = neighbor['ip_addresses']
+            # For Ganeti hosts we need to work out if VMs peer with the switch
+            clusters_bgp_vms = self._get_rack_clusters_bgp_vms({cluster.id for _, cluster in z_devices if cluster})
+            for z_device, cluster in z_devices:
+                try:
+                    # Add the cluster's VMs only once, with the first of its hypervisors
+                    if cluster and cluster.id in clusters_bgp_vms:
+                        for bgp_vm in clusters_bgp_vms.pop(cluster.id):
+                            self._add_bgp_neighbor(bgp_neighbors, bgp_vm)
+
+                    self._add_bgp_neighbor(bgp_neighbors, z_device)
                 except AttributeError:
                     continue
 
-        elif self.role.slug in ('cr'):
+        elif self.is_cr:
             # For core routers fetch all the servers with the bgp routing custom field then filter them more
+            # They are already filtered by Netbox on their active status and BGP flag
             for local_bgp_servers in self.fetch_bgp_servers_l2(self.device_site.slug):
-                neighbor = self.normalize_bgp_neighbor(local_bgp_servers)
-                if neighbor:
-                    bgp_neighbors[neighbor['group']][neighbor['name']] = neighbor['ip_addresses']
+                self._add_bgp_neighbor(bgp_neighbors, local_bgp_servers, check_status=False)
         return bgp_neighbors
 
-    def _get_interface_ip_addresses(self, interface_name):
-        """Returns IPs belonging to a specific interface."""
-        if not self._interface_ip_addresses:
-            self._interface_ip_addresses = {}
-            for ip_address in self.fetch_device_ip_addresses():
-                if ip_address.assigned_object.name not in self._interface_ip_addresses:
-                    self._interface_ip_addresses[ip_address.assigned_object.name] = {4: [], 6: []}
-                self._interface_ip_addresses[ip_address.assigned_object.name][ip_address.family.value].append(
-                    ip_address)
-        return self._interface_ip_addresses[interface_name]
+    def _add_bgp_neighbor(self, bgp_neighbors: DefaultDict, server, check_status: bool = True) -> None:
+        """Add the server to the BGP neighbors, in its BGP group, if it should be one."""
+        neighbor = self.normalize_bgp_neighbor(server, check_status=check_status)
+        if neighbor:
+            bgp_neighbors[neighbor['group']][neighbor['name']] = neighbor['ip_addresses']
+
+    def _get_rack_clusters_bgp_vms(self, cluster_ids: set) -> dict:
+        """Returns the VMs with BGP enabled of the given clusters having all their hypervisors in a single rack."""
+        clusters_bgp_vms: Dict[int, list] = {}
+        if not cluster_ids:
+            return clusters_bgp_vms
+
+        # Fetch the hypervisors of all the clusters at once instead of one call per cluster
+        clusters_rack: Dict[int, Any] = {}  # The rack of the first hypervisor of each cluster
+        multi_racks_clusters = set()
+        hypervisors = self._api.dcim.devices.filter(cluster_id=list(cluster_ids), exclude='config_context', limit=0)
+        for hypervisor in hypervisors:
+            cluster_id = hypervisor.cluster.id
+            if clusters_rack.setdefault(cluster_id, hypervisor.rack) != hypervisor.rack:
+                multi_racks_clusters.add(cluster_id)
+
+        # Cluster is only in this rack, VMs should peer with SW not CR
+        rack_cluster_ids = [cluster_id for cluster_id in clusters_rack if cluster_id not in multi_racks_clusters]
+        if rack_cluster_ids:
+            bgp_vms = self._api.virtualization.virtual_machines.filter(
+                cluster_id=rack_cluster_ids, cf_bgp=True, exclude='config_context', limit=0)
+            for bgp_vm in bgp_vms:
+                clusters_bgp_vms.setdefault(bgp_vm.cluster.id, []).append(bgp_vm)
+
+        return clusters_bgp_vms
+
+    def _get_interface_ip_addresses(self, interface_id):
+        """Returns IPs belonging to a specific interface, given its ID."""
+        self.fetch_device_ip_addresses()
+        return self._interface_ip_addresses.get(interface_id, {4: [], 6: []})
+
+    def _scan_interfaces(self) -> Dict[str, Any]:
+        """Gather in a single pass over the device interfaces the data exposed by multiple keys.
+
+        The port blocks are computed apart in _get_port_block_speeds, so an interface name or type they can't parse
+        only fails that key.
+        """
+        if self._interfaces_scan is not None:
+            return self._interfaces_scan
+
+        lag_count = 0
+        vrfs: Dict[str, Dict[str, Any]] = {}
+        underlay_ints: Optional[list] = [] if 'evpn' in self._device.config else None
+        for interface in self.fetch_device_interfaces():
+            if interface.type.value == 'lag':
+                lag_count += 1
+
+            vrf = interface.vrf
+            if vrf:
+                vrf_data = vrfs.get(vrf.name)
+                if vrf_data is None:  # Don't build a new VRF dict for each of its interfaces
+                    vrf_data = vrfs[vrf.name] = {'ints': [], 'id': vrf.rd}
+                vrf_data['ints'].append(interface.name)
+            elif (underlay_ints is not None and interface.enabled and interface.count_ipaddresses
+                  and not interface.mgmt_only):
+                underlay_ints.append(interface.name)
+
+        self._interfaces_scan = {'lag_count': lag_count, 'vrfs': vrfs, 'underlay_ints': underlay_ints}
+        return self._interfaces_scan
 
     # We have to specify in the Junos chassis stanza how many LAG interfaces we want to provision
     # This function returns how many ae interfaces are configured on the device
     def _get_lag_count(self) -> int:
         """Expose how may LAG interface we need instanciated (includind disabled)."""
-        return sum(1 for nb_int in self.fetch_device_interfaces() if nb_int.type.value == 'lag')
+        return self._scan_interfaces()['lag_count']
 
-    def _get_vrfs(self) -> Optional[defaultdict[defaultdict, defaultdict]]:
+    def _get_vrfs(self) -> Dict[str, Dict[str, Any]]:
         """Gets VRFs that need to be configured by iterating over device interfaces.
 
         Returns:
             dict: keyed by vrf name, with values of Netbox RD and list of member interfaces
 
         """
-        vrfs: DefaultDict[DefaultDict, defaultdict] = defaultdict(lambda: defaultdict(list))
-        for interface in self.fetch_device_interfaces():
-            if interface.vrf:
-                vrfs[interface.vrf.name]['ints'].append(interface.name)
-                vrfs[interface.vrf.name]['id'] = interface.vrf.rd
-
-        return vrfs
+        return self._scan_interfaces()['vrfs']
 
     def _get_underlay_ints(self) -> Optional[list[Dict[str, Any]]]:
         """Returns a list of interface names belonging to the underlay that require OSPF.
@@ -229,15 +477,7 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
             None: the device is not part of an underlay switch fabric requiring OSFP.
 
         """
-        if 'evpn' not in self._device.config:
-            return None
-
-        underlay_ints = []
-        for interface in self.fetch_device_interfaces():
-            if interface.enabled and interface.count_ipaddresses and not interface.vrf and not interface.mgmt_only:
-                underlay_ints.append(interface.name)
-
-        return underlay_ints
+        return self._scan_interfaces()['underlay_ints']
 
     def _get_port_block_speeds(self) -> Optional[Dict[int, int]]:
         """Returns a dict keyed by first port ID of every block of 4 ports and speed for QFX5120-48Y.
@@ -250,25 +490,20 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
         if not self._device.metadata['type'].startswith('qfx5120-48y'):
             return None
 
-        port_blocks = {}
+        port_blocks: Dict[int, int] = {}
         for interface in self.fetch_device_interfaces():
-            if interface.type.value == 'virtual' or interface.type.value == 'lag' or interface.mgmt_only:
+            interface_type = interface.type.value
+            if interface_type == 'virtual' or interface_type == 'lag' or interface.mgmt_only:
                 continue
 
-            port = int(interface.name.split(':')[0].split('/')[-1])
+            port = int(interface.name.partition(':')[0].rpartition('/')[2])
             if port >= 48:
                 continue
 
             block = port - (port % 4)
-            if interface.type.value.startswith('1000base'):
-                speed = 1
-            else:
-                speed = int(interface.type.value.split('gbase')[0])
-
-            if block not in port_blocks:
-                port_blocks[block] = speed
-            elif port_blocks[block] != speed:
-                # Return none if invalid combo, resulting in generated config without pic 0
+            speed = interface_speed(interface_type)
+            if port_blocks.setdefault(block, speed) != speed:
+                # None if invalid combo, resulting in generated config without pic 0
                 # stanza. This prevents an error in Netbox changing working config.
                 return None
 
@@ -291,32 +526,35 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
             # Custom description from Netbox descrtiption field
             return intconf['nb_int_desc']
 
-        if intconf['tunnel']:
-            if intconf['z_dev']:
-                return f"{intconf['link_type']}: " \
-                       f"{intconf['z_dev']}:{intconf['z_int']} {intconf['tunnel']['description']}"
+        z_dev = intconf['z_dev']
+        link_type = intconf['link_type']
+        tunnel = intconf['tunnel']
+        if tunnel:
+            if z_dev:
+                return f"{link_type}: {z_dev}:{intconf['z_int']} {tunnel['description']}"
             else:
-                return intconf['tunnel']['description']
+                return tunnel['description']
 
-        if intconf['circuit_id']:
+        circuit_id = intconf['circuit_id']
+        if circuit_id:
             # Link connects to a third party circuit
-            cct_desc = f"{intconf['circuit_id']} {intconf.get('circuit_desc', '')}".strip()
+            cct_desc = f"{circuit_id} {intconf.get('circuit_desc', '')}".strip()
             if intconf['wmf_z_end']:
                 # Typically transport circuit
-                return f"{intconf['link_type']}: {intconf['z_dev']}:{intconf['z_int']} ({intconf['provider']}, " \
+                return f"{link_type}: {z_dev}:{intconf['z_int']} ({intconf['provider']}, " \
                     f"{cct_desc}) {{#{intconf['cable_label']}}}"
             # Typically transit circuit
-            return f"{intconf['link_type']}: {intconf['provider']} ({cct_desc}) {{#{intconf['cable_label']}}}"
+            return f"{link_type}: {intconf['provider']} ({cct_desc}) {{#{intconf['cable_label']}}}"
 
-        if intconf['z_dev']:
+        if z_dev:
             # Direct link between two WMF devices
-            if intconf['link_type']:
+            if link_type:
                 # Typically 'core' link between two network devices
-                return f"{intconf['link_type']}: {intconf['z_dev']}:{intconf['z_int']} {{#{intconf['cable_label']}}}"
+                return f"{link_type}: {z_dev}:{intconf['z_int']} {{#{intconf['cable_label']}}}"
             if intconf['cable_label']:
                 # Typically server connection
-                return f"{intconf['z_dev']} {{#{intconf['cable_label']}}}"
-            return f"{intconf['z_dev']}"
+                return f"{z_dev} {{#{intconf['cable_label']}}}"
+            return f"{z_dev}"
 
         return ''
 
@@ -340,18 +578,8 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
                                     taken from the 'upstream_speed' attribute of the cct termination (default: None)
 
         """
-        link_data = {
-            "enabled": True,
-            "nb_int_desc": None,
-            "circuit_id": None,
-            "circuit_desc": '',
-            "link_type": '',
-            "z_dev": '',
-            "z_int": '',
-            "wmf_z_end": True,
-            "tunnel": {},
-            "upstream_speed": None
-        }
+        link_data = LINK_DATA_DEFAULTS.copy()
+        link_data['tunnel'] = {}  # Mutable, must not be shared across interfaces
 
         # If the interface is disabled record that and return, other info irrelevant
         if not nb_interface.enabled:
@@ -362,25 +590,22 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
         if nb_interface.description:
             link_data['nb_int_desc'] = nb_interface.description
 
-        if nb_interface.name.startswith("gr-") or nb_interface.name.startswith("st"):
+        if nb_interface.name.startswith(TUNNEL_INTS):
             # Get tunnel termination that matches
-            tunnel_termination = self._api.vpn.tunnel_terminations.get(termination_id=nb_interface.id)
-            if tunnel_termination is None:
+            tunnel_data = self.fetch_tunnels().get(nb_interface.id)
+            if tunnel_data is None:
                 return link_data
-            tunnel = self._api.vpn.tunnels.get(id=tunnel_termination.tunnel.id)
-            link_data['tunnel']['source'] = ip_interface(tunnel_termination.outside_ip.address).ip
+            tunnel_termination, tunnel, z_end_termination = tunnel_data
+            link_data['tunnel']['source'] = address_ip(tunnel_termination.outside_ip.address)
             link_data['tunnel']['name'] = tunnel.name
             link_data['tunnel']['description'] = tunnel.description
             if tunnel_termination.role.value == "spoke":
                 # Right now spoke is only for CF so we can set type based on that
                 link_data['wmf_z_end'] = False
                 link_data['link_type'] = "Transit-tun"
-                link_data['tunnel']['destination'] = ip_interface(
-                    tunnel.group.custom_fields['hub_ip']['address']).ip
+                link_data['tunnel']['destination'] = address_ip(tunnel.group.custom_fields['hub_ip']['address'])
             else:
-                z_end_termination = self._api.vpn.tunnel_terminations.get(tunnel_id=tunnel_termination.tunnel.id,
-                                                                          id__n=tunnel_termination.id)
-                link_data['tunnel']['destination'] = ip_interface(z_end_termination.outside_ip.address).ip
+                link_data['tunnel']['destination'] = address_ip(z_end_termination.outside_ip.address)
                 link_data['z_dev'] = z_end_termination.termination.device.name
                 link_data['z_int'] = z_end_termination.termination.name
                 link_data['link_type'] = "Transport-tun"
@@ -388,18 +613,18 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
                     # Route-based IPsec tunnel, include additional properties
                     link_data['link_type'] = "IPsec-tun"
                     link_data['tunnel']['ipsec'] = {}
-                    ipsec_profile = self._api.vpn.ipsec_profiles.get(id=tunnel.ipsec_profile.id)
+                    ipsec_profile = self.get_vpn_object('ipsec_profiles', tunnel.ipsec_profile.id)
                     # Phase 1 info
-                    ike_policy = self._api.vpn.ike_policies.get(id=ipsec_profile.ike_policy.id)
-                    ike_proposal = self._api.vpn.ike_proposals.get(ike_policy.proposals[0].id)
+                    ike_policy = self.get_vpn_object('ike_policies', ipsec_profile.ike_policy.id)
+                    ike_proposal = self.get_vpn_object('ike_proposals', ike_policy.proposals[0].id)
                     link_data['tunnel']['ipsec']['ike_proposal'] = {
                         'encryption': ike_proposal.encryption_algorithm.value,
                         'dh_group': ike_proposal.group.value
                     }
                     # Phase 2 info
-                    ipsec_policy = self._api.vpn.ipsec_policies.get(id=ipsec_profile.ipsec_policy.id)
+                    ipsec_policy = self.get_vpn_object('ipsec_policies', ipsec_profile.ipsec_policy.id)
                     link_data['tunnel']['ipsec']['pfs_dh_group'] = ipsec_policy.pfs_group.value
-                    ipsec_proposal = self._api.vpn.ipsec_proposals.get(ipsec_policy.proposals[0].id)
+                    ipsec_proposal = self.get_vpn_object('ipsec_proposals', ipsec_policy.proposals[0].id)
                     link_data['tunnel']['ipsec']['ipsec_proposal'] = {
                         'encryption': ipsec_proposal.encryption_algorithm.value
                     }
@@ -409,15 +634,15 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
         a_int = None
         if nb_interface.cable:
             a_int = nb_interface
-        else:
-            # Try to find parent interface based on name
-            for nb_int in self.fetch_device_interfaces():
-                if '.' in nb_interface.name and nb_interface.name.split('.')[0] == nb_int.name:
-                    if nb_int.cable:  # If it's connected, we use that as a_int
-                        a_int = nb_int
-                    if not link_data['nb_int_desc'] and nb_int.description:
-                        # Set sub-int description to parent's netbox description if it has none of its own
-                        link_data['nb_int_desc'] = nb_int.description
+        elif '.' in nb_interface.name:
+            # Try to find parent interface based on name, only sub-interfaces can have one
+            parent_int = self.get_device_interface(nb_interface.name.split('.')[0])
+            if parent_int:
+                if parent_int.cable:  # If it's connected, we use that as a_int
+                    a_int = parent_int
+                if not link_data['nb_int_desc'] and parent_int.description:
+                    # Set sub-int description to parent's netbox description if it has none of its own
+                    link_data['nb_int_desc'] = parent_int.description
 
         # If a_int not set, i.e. no connection, return here as rest of info based on what's connected
         if not a_int:
@@ -443,33 +668,35 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
         # This doesn't handle all the imaginable cases (eg. chaining patch panels and circuits)
         # But handles all our infra cases. To be expanded as needed.
         if b_int.link_peers_type in ('dcim.interface', 'dcim.frontport', 'dcim.rearport'):
-            if a_int.connected_endpoints[0].device.virtual_chassis:
+            z_int = a_int.connected_endpoints[0]
+            z_device = z_int.device
+            if z_device.virtual_chassis:
                 # In VCs we use its virtual name stored in the domain field
                 # And only keep the host part
-                link_data['z_dev'] = a_int.connected_endpoints[0].device.virtual_chassis.domain.split('.')[0]
+                link_data['z_dev'] = z_device.virtual_chassis.domain.split('.')[0]
             else:
-                link_data['z_dev'] = a_int.connected_endpoints[0].device.name
-            link_data['z_int'] = a_int.connected_endpoints[0].name
+                link_data['z_dev'] = z_device.name
+            link_data['z_int'] = z_int.name
             # Set the link type depending on the other side's type
-            core_link_z_dev_types = ['cr', 'asw', 'mr', 'msw', 'pfw', 'cloudsw']
-
-            if a_int.connected_endpoints[0].device.role.slug in core_link_z_dev_types:
+            if z_device.role.slug in CORE_LINK_Z_DEV_ROLES:
                 link_data['link_type'] = 'Core'
 
         if b_int.link_peers_type == 'circuits.circuittermination':
             # Variables needed regardless of the types of circuits
-            link_data['link_type'] = b_int.link_peers[0].circuit.type.name
-            link_data['provider'] = b_int.link_peers[0].circuit.provider.name
-            link_data['circuit_id'] = b_int.link_peers[0].circuit.cid
-            link_data['circuit_desc'] = b_int.link_peers[0].circuit.description
-            if b_int.link_peers[0].circuit.termination_z:
-                link_data['upstream_speed'] = b_int.link_peers[0].circuit.termination_z.upstream_speed
+            circuit = b_int.link_peers[0].circuit
+            link_data['link_type'] = circuit.type.name
+            link_data['provider'] = circuit.provider.name
+            link_data['circuit_id'] = circuit.cid
+            link_data['circuit_desc'] = circuit.description
+            if circuit.termination_z:
+                link_data['upstream_speed'] = circuit.termination_z.upstream_speed
 
             if not a_int.connected_endpoints or a_int.connected_endpoints_type == 'circuits.providernetwork':
                 link_data['wmf_z_end'] = False
             else:
-                link_data['z_dev'] = a_int.connected_endpoints[0].device.name
-                link_data['z_int'] = a_int.connected_endpoints[0].name
+                z_int = a_int.connected_endpoints[0]
+                link_data['z_dev'] = z_int.device.name
+                link_data['z_int'] = z_int.name
 
         return link_data
 
@@ -484,12 +711,9 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
                   units: dict keyed by interface unit number to place above elements when they need to be added there
         """
 
-        if self._qos_interfaces:
+        if self._qos_interfaces is not None:
             return self._qos_interfaces
 
-        if not self._junos_interfaces:
-            self._get_junos_interfaces()
-
         DSCP_V4_CLASSIFIER = {
             'dscp_classifier': True
         }
@@ -499,33 +723,34 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
             'dscp_ip6_classifier': True
         }
 
+        # Kept a defaultdict: templates index it by interface name and homer renders them with StrictUndefined
         qos_ints: DefaultDict = defaultdict(dict)
-        for int_name, int_conf in self._junos_interfaces.items():
+        for int_name, int_conf in self._get_junos_interfaces().items():
             # We ignore certain interfaces
             if int_name.startswith(NO_QOS_INTS) or 'lag' in int_conf or not int_conf['enabled']:
                 continue
 
             # Remaining will all get QoS so create element in dict for it
-            qos_ints[int_name]['units'] = {}
+            qos_int = qos_ints[int_name] = {'units': {}}
             if "description" in int_conf:
-                qos_ints[int_name]['description'] = int_conf['description']
+                qos_int['description'] = int_conf['description']
             # If circuit has sub-rated peak rate set the shaper to 98% of max
             if "upstream_speed" in int_conf and int_conf['upstream_speed']:
-                qos_ints[int_name]['shape_rate'] = int(int_conf['upstream_speed'] * 0.98)
+                qos_int['shape_rate'] = int(int_conf['upstream_speed'] * 0.98)
 
-            if self.role.slug in SWITCHES_ROLES:
+            if self.is_switch:
                 # Standard L2 ports facing servers or CRs
                 if 'vlans' in int_conf and int_conf['vlans']:
-                    if self.device_type.slug in JUNIPER_LEGACY_SW:
-                        qos_ints[int_name]['units'][0] = DSCP_V4_CLASSIFIER
+                    if self.is_legacy_switch:
+                        qos_int['units'][0] = DSCP_V4_CLASSIFIER
                     else:
-                        qos_ints[int_name]['units'][0] = DSCP_DUAL_CLASSIFIER
+                        qos_int['units'][0] = DSCP_DUAL_CLASSIFIER
 
                 # L3 routed interfaces or ports with routed sub-interfaces
                 elif "ips" in int_conf or "sub" in int_conf:
-                    qos_ints[int_name].update(DSCP_V4_CLASSIFIER)
+                    qos_int.update(DSCP_V4_CLASSIFIER)
 
-            elif self.role.slug == "cr":
+            elif self.is_cr:
                 if "sub" in int_conf:
                     units = int_conf['sub'].keys()
                 else:
@@ -533,11 +758,11 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
 
                 if "link_type" in int_conf and int_conf['link_type'] in ('Core', 'Transport'):
                     for unit in units:
-                        qos_ints[int_name]['units'][unit] = DSCP_DUAL_CLASSIFIER
+                        qos_int['units'][unit] = DSCP_DUAL_CLASSIFIER
                 elif int_name.startswith("gr-"):
                     for unit, sub_conf in int_conf['sub'].items():
                         if sub_conf['link_type'] == "Transport-tun":
-                            qos_ints[int_name]['units'][unit] = DSCP_DUAL_CLASSIFIER
+                            qos_int['units'][unit] = DSCP_DUAL_CLASSIFIER
 
         self._qos_interfaces = qos_ints
         return qos_ints
@@ -547,26 +772,23 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
     # Else return None
     def interface_mtu(self, interface_name: str):
         """Return the MTU to use on a given interface."""
-        mtu = None
-        for nb_int in self.fetch_device_interfaces():
-            if nb_int.name == interface_name and nb_int.enabled and nb_int.mtu:
-                # Exact match found
-                return nb_int.mtu
-            if '.' in interface_name and interface_name.split('.')[0] == nb_int.name and nb_int.mtu and nb_int.enabled:
-                # Parent interface found and it have an MTU!
-                mtu = nb_int.mtu
-        # Wait to be done iterating over all the device' interfaces
-        # in case an exact match is found after the parent
-        return mtu
+        # Exact match first, fallback to the parent interface's MTU if any
+        nb_int = self.get_device_interface(interface_name)
+        if nb_int and nb_int.enabled and nb_int.mtu:
+            return nb_int.mtu
+        if '.' in interface_name:
+            parent_int = self.get_device_interface(interface_name.split('.')[0])
+            if parent_int and parent_int.enabled and parent_int.mtu:
+                return parent_int.mtu
+        return None
 
     def _get_junos_interfaces(self):
         """Expose Netbox interfaces in a way that can be efficiently used by a junos template."""
-        if self._junos_interfaces:
+        if self._junos_interfaces is not None:
             return self._junos_interfaces
 
-        jri = {}  # Junos interfaces
+        interfaces = {}  # Interfaces config keyed by name, sub-interfaces are nested only once all are processed
         lags_members = defaultdict(list)  # List all the lags to find mixed ones
-        ignore_interfaces = ['fxp0-re0', 'fxp0-re1']  # Those are managed in `set groups`
         # Here, unlike for switches, we don't try to group interfaces together but set the proper attributes directly
         for nb_int in self.fetch_device_interfaces():
             # Regarless of what kind of interface it is, set attributes in a Juniper-ish tree
@@ -574,7 +796,7 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
             # TODO skip the ones we don't want
             interface_config['enabled'] = nb_int.enabled
             interface_name = nb_int.name
-            if interface_name in ignore_interfaces:
+            if interface_name in IGNORED_INTERFACES:
                 continue
             # Ignore VC links
             if interface_name.startswith('vcp'):
@@ -585,119 +807,130 @@ class NetboxDeviceDataPlugin(BaseNetboxDeviceData):
 
             interface_config['type'] = nb_int.type.value
 
-            if nb_int.lag:
-                interface_config['lag'] = nb_int.lag.name
-                jri[interface_name] = interface_config
+            lag = nb_int.lag
+            if lag:
+                interface_config['lag'] = lag.name
+                interfaces[interface_name] = interface_config
                 # We store the interfaces contributing to a specific LAG, because if they are of different types,
                 # We will later need to apply the "link-speed mixed" config option.
-                lags_members[nb_int.lag.name].append(interface_name)
+                lags_members[lag.name].append(interface_name)
                 continue
             # For a LAG, the MTU is set on the ae (virtual) interface not the physical ones (bundle members)
             interface_config['mtu'] = self.interface_mtu(interface_name)
 
-            if nb_int.mac_address:  # Set the MAC if any in netbox
-                interface_config['mac'] = nb_int.mac_address
+            mac_address = nb_int.mac_address
+            if mac_address:  # Set the MAC if any in netbox
+                interface_config['mac'] = mac_address
 
-            if nb_int.vrf:  # Set the VRF if any in netbox
-                interface_config['vrf'] = nb_int.vrf.name
+            vrf = nb_int.vrf
+            if vrf:  # Set the VRF if any in netbox
+                interface_config['vrf'] = vrf.name
 
-            if nb_int.mode:  # If the interface is tagged or access
-                interface_config['mode'] = nb_int.mode.value
+            mode = nb_int.mode
+            if mode:  # If the interface is tagged or access
+                mode_value = mode.value
+                interface_config['mode'] = mode_value
+                untagged_vlan = nb_int.untagged_vlan
                 # We keep the tagged vlan names
-                interface_vlans = set()
-
-                # Interface is set to access but doesn't have any vlan configured: set to default
-                if interface_config['mode'] == 'access' and not nb_int.untagged_vlan:
-                    interface_vlans.add('default')
-
-                # If any tagged interfaces add them to the list
-                if nb_int.mode.value == 'tagged':
-                    for tagged_vlan in nb_int.tagged_vlans:
-                        interface_vlans.add(tagged_vlan.name)
+                if mode_value == 'tagged':
+                    # If any tagged interfaces add them to the list
+                    interface_vlans = {tagged_vlan.name for tagged_vlan in nb_int.tagged_vlans}
+                elif mode_value == 'access' and not untagged_vlan:
+                    # Interface is set to access but doesn't have any vlan configured: set to default
+                    interface_vlans = {'default'}
+                else:
+                    interface_vlans = set()
 
                 # If there is an untagged interface, add it to the list
                 # Either it's a trunked interface, in that case it will be with the other vlans
                 # Or it's an access interface and it will be alone
-                if nb_int.untagged_vlan:
-                    interface_vlans.add(nb_int.untagged_vlan.name)
+                if untagged_vlan:
+                    interface_vlans.add(untagged_vlan.name)
                     # Junos needs the native vlan ID and not the name
-                    if nb_int.mode.value == 'tagged':
-                        interface_config['native_vlan_id'] = nb_int.untagged_vlan.vid
+                    if mode_value == 'tagged':
+                        interface_config['native_vlan_id'] = untagged_vlan.vid
 
-                interface_config['vlans'] = list(interface_vlans)
+                interface_config['vlans'] = sorted(interface_vlans)
 
             # Assign the IPs to the interface if any
-            if nb_int.count_ipaddresses > 0:
+            if nb_int.count_ipaddresses:
                 # assumes there is v4 for everything
                 interface_config['ips'] = {4: {}, 6: {}}
-                virt_ips = {}
-                int_addresses = self._get_interface_ip_addresses(nb_int.name)
-                for address_fam in [4, 6]:
-                    for ip_address in int_addresses[address_fam]:
+                virt_ips = {}  # Virtual IP addresses, with their VRRP data if any
+                int_addresses = self._get_interface_ip_addresses(nb_int.id)
+                anycast_gw = None  # The IPv6 anycast IPs, if any, take precedence over the IPv4 ones
+                for address_fam in (4, 6):
+                    family_addresses = int_addresses[address_fam]
+                    family_ips = interface_config['ips'][address_fam]
+                    multiple_addresses = len(family_addresses) > 1
+                    for ip_address in family_addresses:
                         if ip_address.role and ip_address.role.value == 'anycast':
-                            if len(int_addresses[address_fam]) > 1:
+                            if multiple_addresses:
                                 # Int must also have a unique IP so we just save this as VGA VIP
-                                virt_ips[ip_address.address] = None
-                                interface_config['anycast_gw'] = 'vga'
+                                virt_ips[address_ip(ip_address.address)] = None
+                                anycast_gw = 'vga'
                                 continue
                             else:
-                                interface_config['anycast_gw'] = 'single'
-                        interface_config['ips'][address_fam][ip_interface(ip_address.address)] = {}
+                                anycast_gw = 'single'
+                        family_ips[cached_ip_interface(ip_address.address)] = {}
+                if anycast_gw is not None:
+                    interface_config['anycast_gw'] = anycast_gw
 
                 # Assume that interfaces with FHRP IPs will always have "real" IPs
-                if nb_int.count_fhrp_groups > 0:
-                    for fhrp_assignment in self._api.ipam.fhrp_group_assignments.filter(interface_id=nb_int.id):
-                        for ip_addresses in fhrp_assignment.group.ip_addresses:
-                            virt_ips[ip_addresses.address] = {
-                                'group': fhrp_assignment.group.group_id,
+                if nb_int.count_fhrp_groups:
+                    for fhrp_assignment in self.fetch_fhrp_assignments().get(nb_int.id, []):
+                        fhrp_group = self.get_fhrp_group(fhrp_assignment.group.id)
+                        for ip_addresses in fhrp_group.ip_addresses:
+                            virt_ips[address_ip(ip_addresses.address)] = {
+                                'group': fhrp_group.group_id,
                                 'priority': fhrp_assignment.priority
                             }
 
                 # Now assign any VRRP/Anycast IP to the real interface,
                 # for that we need to find IPs belonging in the same subnet
-                for family, int_ips in interface_config['ips'].items():
-                    for int_ip in int_ips.keys():
-                        for virt_ip, vrrp_data in virt_ips.items():
-                            if ip_interface(virt_ip) in int_ip.network:
-                                if vrrp_data is None:
-                                    # Anycast GW Interface so no VRRP info
-                                    interface_config['ips'][family][int_ip]['anycast'] = ip_interface(virt_ip).ip
-                                else:
-                                    interface_config['ips'][family][int_ip]['vrrp'] = {
-                                        ip_interface(virt_ip).ip: vrrp_data
-                                    }
-
-            # Now that we have all the interface attributes, we add it to the jri dict,
-            # either directly or as a 'sub' to the parent int
-            if '.' in interface_name:
-                # Sub-interface - add sub to existing parent or create it with sub
-                parent, sub = interface_name.split('.', 1)
-                if parent in jri:
-                    if 'sub' not in jri[parent]:
-                        jri[parent]['sub'] = {}
-                    jri[parent]['sub'][sub] = interface_config
-                else:
-                    jri[parent] = {'sub': {sub: interface_config}, 'enabled': True}
-            else:
-                # Physical-int - merge data with existing or add as new element
-                try:
-                    jri[interface_name].update(interface_config)
-                except KeyError:
-                    jri[interface_name] = interface_config
+                if virt_ips:  # Most interfaces have none
+                    for int_ips in interface_config['ips'].values():
+                        for int_ip, int_ip_config in int_ips.items():
+                            int_network = int_ip.network
+                            for virt_address, vrrp_data in virt_ips.items():
+                                if virt_address in int_network:
+                                    if vrrp_data is None:
+                                        # Anycast GW Interface so no VRRP info
+                                        int_ip_config['anycast'] = virt_address
+                                    else:
+                                        int_ip_config['vrrp'] = {virt_address: vrrp_data}
+
+            interfaces[interface_name] = interface_config
 
             # TODO Remove some Juniper oddities, eg. sub interfaces for LAG members
 
+        # Now that we have all the interfaces attributes, we add them to the jri dict,
+        # either directly or as a 'sub' to the parent int
+        jri = {}  # Junos interfaces
+        for interface_name, interface_config in interfaces.items():
+            parent, _, sub = interface_name.partition('.')
+            if not sub:  # Physical-int
+                jri[interface_name] = interface_config
+                continue
+            # Sub-interface - add sub to the parent, creating it if it's not in Netbox
+            parent_config = jri.get(parent)
+            if parent_config is None:
+                parent_config = jri[parent] = interfaces.get(parent, {'enabled': True})
+            parent_config.setdefault('sub', {})[sub] = interface_config
+
         # Process LAGs
         for lag, members in lags_members.items():
+            lag_config = jri[lag]
             # If mixed-speed ints (based on int name) set mode to mixed
-            if len(set([member.split('-')[0] for member in members])) > 1:
-                jri[lag]['mixed'] = True
+            first_prefix = members[0].split('-', 1)[0]
+            if any(member.split('-', 1)[0] != first_prefix for member in members[1:]):
+                lag_config['mixed'] = True
             # Copy 'link_type' parameter from member to LAG itself
-            if not jri[lag]['link_type']:
-                for member in members:
-                    if jri[member]['link_type']:
-                        jri[lag]['link_type'] = jri[member]['link_type']
-                        break
+            if not lag_config['link_type']:
+                member_link_type = next((jri[member]['link_type'] for member in members
+                                         if jri[member]['link_type']), None)
+                if member_link_type:
+                    lag_config['link_type'] = member_link_type
 
         self._junos_interfaces = jri
         return jri